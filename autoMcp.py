@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-import asyncio, logging, os, signal, subprocess, sys, threading, time
+import asyncio, atexit, codecs, logging, logging.handlers, os, queue, signal, subprocess, sys, time
 from typing import Dict, Optional, Union
 
 from interactive_shell_utils import looks_like_repl, contains_prompt
@@ -11,59 +11,282 @@ RESTART_CODE = 87
 
 # ────────────────────────── config & logger ──────────────────────────────
 DEFAULT_TIMEOUT = 60           # seconds
+READ_CHUNK = 64 << 10          # bytes per pipe read
+OUTPUT_ENCODING = "utf-8"      # child output is read as bytes, decoded with this
+MAX_OUTPUT = 4 << 20           # bytes of output kept per command
+KILL_GRACE = 2.0               # seconds between SIGTERM and SIGKILL
+PIPE_DRAIN = 0.1               # seconds to collect output still in flight after exit
+MAX_EDIT_BYTES = 8 << 20       # pyEdit refuses to read larger files
 LOG_PATH = "bash_safe.log"
 
+
+class _CachedTimeFormatter(logging.Formatter):
+    """Formatter that calls ``strftime`` at most once per second."""
+
+    _cache: tuple[int, str] = (-1, "")
+
+    def formatTime(self, record: logging.LogRecord, datefmt: str | None = None) -> str:
+        if datefmt:
+            return super().formatTime(record, datefmt)
+        sec, stamp = self._cache
+        if sec != int(record.created):
+            sec = int(record.created)
+            stamp = time.strftime(self.default_time_format, self.converter(sec))
+            self._cache = (sec, stamp)
+        return self.default_msec_format % (stamp, record.msecs)
+
+
+class _AppendHandler(logging.Handler):
+    """Append UTF-8 records to *path* with ``os.write`` on a raw O_APPEND fd."""
+
+    def __init__(self, path: str) -> None:
+        super().__init__()
+        flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND | getattr(os, "O_BINARY", 0)
+        self._fd = os.open(path, flags, 0o644)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            data = memoryview((self.format(record) + "\n").encode("utf-8", "replace"))
+            while data:
+                data = data[os.write(self._fd, data):]
+        except Exception:
+            self.handleError(record)
+
+    def close(self) -> None:
+        with self.lock:
+            if self._fd >= 0:
+                os.close(self._fd)
+                self._fd = -1
+        super().close()
+
+
 _logger = logging.getLogger("bash_safe")
+_log_listener: Optional[logging.handlers.QueueListener] = None
 if not _logger.handlers:
+    # QueueHandler interpolates the message on the caller's thread and only
+    # enqueues it; the listener thread adds the timestamp/level prefix and
+    # does the disk writes off the event loop.
     _logger.setLevel(logging.DEBUG)
-    h = logging.FileHandler(LOG_PATH, encoding="utf-8")
-    h.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s"))
-    _logger.addHandler(h)
+    h = _AppendHandler(LOG_PATH)
+    h.setFormatter(_CachedTimeFormatter("%(asctime)s [%(levelname)s] %(message)s"))
+    q: queue.SimpleQueue = queue.SimpleQueue()
+    _logger.addHandler(logging.handlers.QueueHandler(q))
+    _log_listener = logging.handlers.QueueListener(q, h)
+    _log_listener.start()
+    atexit.register(_log_listener.stop)
+
+# ────────────────────────── Windows job objects ──────────────────────────
+# Each bash_safe child on Windows is started suspended and placed in its own
+# job, so the whole tree can be terminated with one call. Kill-on-close only
+# matters if the worker dies mid-command; a normal completion clears it first.
+_jobs: Dict[int, int] = {}     # pid → job handle
+
+if os.name == "nt":
+    import ctypes
+    from ctypes import wintypes
+
+    _CREATE_SUSPENDED = 0x00000004
+    _PROCESS_ACCESS = 0x0001 | 0x0100 | 0x0800   # TERMINATE | SET_QUOTA | SUSPEND_RESUME
+    _JOB_OBJECT_LIMIT_KILL_ON_JOB_CLOSE = 0x2000
+    _JobObjectExtendedLimitInformation = 9
+
+    class _JOBOBJECT_BASIC_LIMIT_INFORMATION(ctypes.Structure):
+        _fields_ = [
+            ("PerProcessUserTimeLimit", ctypes.c_int64),
+            ("PerJobUserTimeLimit", ctypes.c_int64),
+            ("LimitFlags", wintypes.DWORD),
+            ("MinimumWorkingSetSize", ctypes.c_size_t),
+            ("MaximumWorkingSetSize", ctypes.c_size_t),
+            ("ActiveProcessLimit", wintypes.DWORD),
+            ("Affinity", ctypes.c_size_t),
+            ("PriorityClass", wintypes.DWORD),
+            ("SchedulingClass", wintypes.DWORD),
+        ]
+
+    class _IO_COUNTERS(ctypes.Structure):
+        _fields_ = [(name, ctypes.c_uint64) for name in (
+            "ReadOperationCount", "WriteOperationCount", "OtherOperationCount",
+            "ReadTransferCount", "WriteTransferCount", "OtherTransferCount",
+        )]
+
+    class _JOBOBJECT_EXTENDED_LIMIT_INFORMATION(ctypes.Structure):
+        _fields_ = [
+            ("BasicLimitInformation", _JOBOBJECT_BASIC_LIMIT_INFORMATION),
+            ("IoInfo", _IO_COUNTERS),
+            ("ProcessMemoryLimit", ctypes.c_size_t),
+            ("JobMemoryLimit", ctypes.c_size_t),
+            ("PeakProcessMemoryUsed", ctypes.c_size_t),
+            ("PeakJobMemoryUsed", ctypes.c_size_t),
+        ]
+
+    _k32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    _ntdll = ctypes.WinDLL("ntdll")
+    _k32.CreateJobObjectW.restype = wintypes.HANDLE
+    _k32.CreateJobObjectW.argtypes = (wintypes.LPVOID, wintypes.LPCWSTR)
+    _k32.SetInformationJobObject.argtypes = (wintypes.HANDLE, ctypes.c_int, wintypes.LPVOID, wintypes.DWORD)
+    _k32.OpenProcess.restype = wintypes.HANDLE
+    _k32.OpenProcess.argtypes = (wintypes.DWORD, wintypes.BOOL, wintypes.DWORD)
+    _k32.AssignProcessToJobObject.argtypes = (wintypes.HANDLE, wintypes.HANDLE)
+    _k32.TerminateJobObject.argtypes = (wintypes.HANDLE, wintypes.UINT)
+    _k32.CloseHandle.argtypes = (wintypes.HANDLE,)
+    _ntdll.NtResumeProcess.argtypes = (wintypes.HANDLE,)
+
+    def _attach_job(pid: int) -> None:
+        """Put suspended *pid* into a new kill-on-close job, then resume it."""
+        hproc = _k32.OpenProcess(_PROCESS_ACCESS, False, pid)
+        if not hproc:
+            raise ctypes.WinError(ctypes.get_last_error())
+        try:
+            job = _k32.CreateJobObjectW(None, None)
+            if not job:
+                _logger.warning("CreateJobObject failed: %s", ctypes.WinError(ctypes.get_last_error()))
+                return
+            info = _JOBOBJECT_EXTENDED_LIMIT_INFORMATION()
+            info.BasicLimitInformation.LimitFlags = _JOB_OBJECT_LIMIT_KILL_ON_JOB_CLOSE
+            if _k32.SetInformationJobObject(
+                job, _JobObjectExtendedLimitInformation, ctypes.byref(info), ctypes.sizeof(info)
+            ) and _k32.AssignProcessToJobObject(job, hproc):
+                _jobs[pid] = job
+            else:
+                _logger.warning("Job assignment failed: %s", ctypes.WinError(ctypes.get_last_error()))
+                _k32.CloseHandle(job)
+        finally:
+            _ntdll.NtResumeProcess(hproc)
+            _k32.CloseHandle(hproc)
+
+
+def _close_job(pid: int) -> None:
+    """Release *pid*'s job handle, leaving background descendants running."""
+    job = _jobs.pop(pid, None)
+    if job is not None:
+        info = _JOBOBJECT_EXTENDED_LIMIT_INFORMATION()     # LimitFlags = 0
+        _k32.SetInformationJobObject(
+            job, _JobObjectExtendedLimitInformation, ctypes.byref(info), ctypes.sizeof(info)
+        )
+        _k32.CloseHandle(job)
 
 # ────────────────────────── helpers ──────────────────────────────────────
-def _kill_tree(pid: int) -> None:
-    """Best-effort terminate *pid* and its children (cross-platform)."""
+async def _kill_tree(
+    proc: asyncio.subprocess.Process, child: _ChildProtocol, reader: asyncio.Task
+) -> None:
+    """Terminate *proc* and its children (cross-platform), then reap it.
+
+    On POSIX the session gets SIGTERM. If the shell is still running after
+    KILL_GRACE seconds, or it exited but other group members keep the output
+    pipe (*reader*) open that long, the group gets SIGKILL. Processes that
+    left the session are out of reach; bash_safe stops waiting for them.
+    """
     if os.name == "nt":
-        subprocess.call(
-            ["taskkill", "/PID", str(pid), "/T", "/F"],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-        )
+        job = _jobs.pop(proc.pid, None)
+        if job is not None:
+            _k32.TerminateJobObject(job, 1)
+            _k32.CloseHandle(job)
+        else:   # not in a job (assignment failed) – fall back to taskkill
+            subprocess.call(
+                ["taskkill", "/PID", str(proc.pid), "/T", "/F"],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
     else:
+        # start_new_session=True makes the pid the group id, and the group
+        # outlives its leader, so no getpgid() lookup is needed.
+        _signal_group(proc.pid, signal.SIGTERM)
         try:
-            os.killpg(pid, signal.SIGTERM)
-        except OSError:
-            pass
+            await asyncio.wait_for(child.exited.wait(), KILL_GRACE)
+        except TimeoutError:
+            _logger.warning("Process group %d ignored SIGTERM – sending SIGKILL.", proc.pid)
+            _signal_group(proc.pid, signal.SIGKILL)
+        else:
+            await asyncio.wait({reader}, timeout=KILL_GRACE)
+            if not reader.done() and _signal_group(proc.pid, signal.SIGKILL):
+                _logger.warning("Process group %d outlived its leader – sent SIGKILL.", proc.pid)
+    await child.exited.wait()
+
+
+def _signal_group(pgid: int, sig: int) -> bool:
+    """Send *sig* to process group *pgid*; False if the group is gone."""
+    try:
+        os.killpg(pgid, sig)
+    except (ProcessLookupError, PermissionError):
+        return False
+    return True
+
+
+class _ChildProtocol(asyncio.subprocess.SubprocessStreamProtocol):
+    """Stream protocol that also signals when the process itself exits.
+
+    ``Process.wait()`` only resolves once every pipe is closed as well, which
+    a background or detached descendant can postpone indefinitely.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(limit=READ_CHUNK, loop=asyncio.get_running_loop())
+        self.exited = asyncio.Event()
+        self.transport: Optional[asyncio.SubprocessTransport] = None
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        super().connection_made(transport)
+        self.transport = transport
 
+    def process_exited(self) -> None:
+        super().process_exited()
+        self.exited.set()
 
-def _start_process(command: str) -> subprocess.Popen:
+
+async def _start_process(command: str) -> tuple[asyncio.subprocess.Process, _ChildProtocol]:
     """Spawn *command* in its own process group/session."""
+    loop = asyncio.get_running_loop()
     if os.name == "nt":
-        return subprocess.Popen(
+        transport, child = await loop.subprocess_shell(
+            _ChildProtocol,
             command,
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            creationflags=subprocess.CREATE_NEW_PROCESS_GROUP,
+            stdin=None,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            creationflags=subprocess.CREATE_NEW_PROCESS_GROUP | _CREATE_SUSPENDED,
         )
+        try:
+            _attach_job(transport.get_pid())
+        except OSError:
+            transport.kill()
+            raise
     else:
-        return subprocess.Popen(
+        transport, child = await loop.subprocess_shell(
+            _ChildProtocol,
             command,
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
+            stdin=None,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
             start_new_session=True,
         )
+    return asyncio.subprocess.Process(transport, child, loop), child
 
 
-def _pump(proc: subprocess.Popen, buf: list[str]) -> None:
-    """Background thread to mirror subprocess output to log."""
-    with proc.stdout:
-        for line in iter(proc.stdout.readline, ""):
-            buf.append(line)
-            _logger.debug(line.rstrip())
+async def _drain(stream: asyncio.StreamReader, buf: bytearray) -> None:
+    """Collect *stream* into *buf* and mirror it to the log until EOF.
+
+    Output is logged as one record per read, cut at the last newline, and is
+    not decoded at all when DEBUG is off. *buf* keeps at most MAX_OUTPUT + 1
+    bytes, so a longer buffer tells the caller output was cut; the rest is
+    still read (so the child never blocks on a full pipe) but discarded.
+    """
+    log = _logger.isEnabledFor(logging.DEBUG)
+    decoder = codecs.getincrementaldecoder(OUTPUT_ENCODING)(errors="replace")
+    pending = ""
+    while chunk := await stream.read(READ_CHUNK):
+        chunk = chunk[:MAX_OUTPUT + 1 - len(buf)]
+        if not chunk:
+            continue
+        buf += chunk
+        if log:
+            text = pending + decoder.decode(chunk)
+            lines, nl, pending = text.rpartition("\n")
+            if not nl and len(pending) >= READ_CHUNK:   # no newline in sight
+                lines, pending = pending, ""
+            if lines:
+                _logger.debug("%s", lines)
+    if log and (pending := pending + decoder.decode(b"", final=True)):
+        _logger.debug("%s", pending)
 
 # ────────────────────────── MCP tools ────────────────────────────────────
 @mcp.tool()
@@ -82,30 +305,39 @@ async def bash_safe(command: str, *, timeout: int = DEFAULT_TIMEOUT) -> Dict[str
         return {"output": "", "warning": f"Blocked: {reason}", "returncode": None}
 
     _logger.info("EXEC ➜ %s", command)
-    proc = _start_process(command)
-    lines: list[str] = []
-    threading.Thread(target=_pump, args=(proc, lines), daemon=True).start()
-
-    start = time.time()
+    proc, child = await _start_process(command)
+    buf = bytearray()
+    reader = asyncio.create_task(_drain(proc.stdout, buf))
     warn: Optional[str] = None
 
-    while proc.poll() is None:
-        await asyncio.sleep(0.05)
-        if time.time() - start > timeout:
-            warn = f"Process exceeded {timeout}s – terminating."
-            _logger.warning(warn)
-            if os.name == "nt":
-                proc.send_signal(signal.CTRL_BREAK_EVENT)
-                try:
-                    proc.wait(5)
-                except subprocess.TimeoutExpired:
-                    _kill_tree(proc.pid)
-            else:
-                _kill_tree(proc.pid)
-            proc.wait()
-            break
+    try:
+        # Exit is reported by the loop's child watcher, so completion is
+        # noticed immediately.
+        async with asyncio.timeout(timeout):
+            await child.exited.wait()
+    except TimeoutError:
+        warn = f"Process exceeded {timeout}s – terminating."
+        _logger.warning(warn)
+        await _kill_tree(proc, child, reader)
 
-    output = "".join(lines).strip()
+    # Background jobs, or daemons that left the session, can keep the pipe
+    # open indefinitely; their output only gets a short grace period.
+    await asyncio.wait({reader}, timeout=PIPE_DRAIN)
+    if not reader.done():
+        # After a timeout the whole group is dead, so the holder left the session.
+        holder = "a detached" if warn else "a background"
+        _logger.warning("Output pipe held open by %s process – not waiting for it.", holder)
+        reader.cancel()
+        await asyncio.wait({reader})
+        child.transport.close()
+    _close_job(proc.pid)
+    if len(buf) > MAX_OUTPUT:
+        del buf[MAX_OUTPUT:]
+        trunc = f"Output truncated at {MAX_OUTPUT >> 20} MiB."
+        _logger.warning(trunc)
+        warn = f"{warn} {trunc}" if warn else trunc
+
+    output = buf.decode(OUTPUT_ENCODING, errors="replace").strip()
     if not warn and contains_prompt(output):
         warn = "Output ends with a prompt-like string."
         _logger.warning(warn)
@@ -124,11 +356,19 @@ async def pyEdit(filepath: str, content: str | None = None) -> str:
         if content is None:
             if not os.path.isfile(filepath):
                 return f"Error: File '{filepath}' does not exist."
-            with open(filepath, "r", encoding="utf-8") as f:
-                return f.read()
+            if os.stat(filepath).st_size > MAX_EDIT_BYTES:
+                return f"Error: File '{filepath}' is larger than {MAX_EDIT_BYTES >> 20} MiB."
+            with open(filepath, "rb") as f:
+                return f.read().decode("utf-8")
         else:
-            with open(filepath, "w", encoding="utf-8") as f:
-                f.write(content)
+            data = content.encode("utf-8")
+            with open(filepath, "wb") as f:
+                if data and hasattr(os, "posix_fallocate"):
+                    try:
+                        os.posix_fallocate(f.fileno(), 0, len(data))
+                    except OSError:
+                        pass    # unsupported filesystem; just write
+                f.write(data)
             return f"Successfully wrote to '{filepath}'."
     except Exception as e:
         return f"Exception: {e}"
@@ -139,21 +379,30 @@ async def request_restart() -> str:
     """
     Tell the wrapper to respawn this worker.
 
-    We first *return* a confirmation string, then—on a background thread—sleep
-    200 ms and exit with the reserved code so the wrapper can restart us.
+    We first *return* a confirmation string, then—200 ms later, on the event
+    loop that sent it—exit with the reserved code so the wrapper can restart us.
     """
     def _delayed_exit():
-        time.sleep(0.2)
-        # flush just in case
+        # flush just in case; os._exit skips atexit, so drain the log too
+        if _log_listener is not None:
+            _log_listener.stop()
         sys.stdout.flush()
         sys.stderr.flush()
         os._exit(RESTART_CODE)        # immediate, cross-platform
 
-    threading.Thread(target=_delayed_exit, daemon=True).start()
+    asyncio.get_running_loop().call_later(0.2, _delayed_exit)
 
     # This string reaches the Claude desktop before the process dies
     return "✅  Restart requested – worker will be back in a second."
 
 # ────────────────────────── bootstrap ────────────────────────────────────
 if __name__ == "__main__":
-    mcp.run(transport="stdio")
+    try:
+        import uvloop  # noqa: F401            optional, faster pipes/SIGCHLD
+    except ImportError:                        # not installed, or Windows
+        mcp.run(transport="stdio")
+    else:
+        # What mcp.run(transport="stdio") does, but on a uvloop loop handed
+        # to anyio directly rather than via the global loop policy.
+        import anyio
+        anyio.run(mcp.run_stdio_async, backend_options={"use_uvloop": True})
@@ -4,7 +4,7 @@ can refuse or warn when a command would drop into a REPL.
 """
 
 from __future__ import annotations
-import os, re, shlex
+import os, re, shlex, sys
 from typing import Dict, List
 
 # ────────────────────────── heuristics data ──────────────────────────────
@@ -27,6 +27,15 @@ INTERACTIVE_FLAGS: set[str] = {
     "-noexit", "-NoExit",   # PowerShell
 }
 
+# Lookup keys, lower-cased like the tokens they are compared against.
+_SHELL_KEYS = frozenset(map(sys.intern, INTERACTIVE_SHELLS))
+_FLAG_KEYS = frozenset(sys.intern(flag.lower()) for flag in INTERACTIVE_FLAGS)
+# Only quoting/escapes make shlex split the leading words differently, and
+# str.split() only agrees with shlex (' \t\r\n') on ASCII input without
+# the other whitespace control characters.
+_SHELL_META = re.compile(r"[\"'\\]")
+_ODD_SPACE = re.compile(r"[\x0b\x0c\x1c-\x1f]")
+
 PROMPT_REGEXES: List[re.Pattern[str]] = [
     re.compile(r">>> ?$"),                  # Python
     re.compile(r"In \[\d+]: ?$"),           # IPython / Jupyter
@@ -34,26 +43,44 @@ PROMPT_REGEXES: List[re.Pattern[str]] = [
     re.compile(r"[A-Za-z]:\\.*?> ?$"),      # cmd.exe
     re.compile(r"PS [A-Za-z]:\\.*?> ?$"),   # PowerShell
 ]
+PROMPT_WINDOW = 512    # chars of trailing output inspected for a prompt
+
+# All of the above as one alternation, so a line is scanned once.
+_PROMPT_RX = re.compile(
+    "|".join(f"(?:{rx.pattern})" for rx in PROMPT_REGEXES), re.ASCII
+)
 
 # ────────────────────────── public helpers ───────────────────────────────
 def looks_like_repl(command: str) -> str | None:
     """Return a reason string if *command* would likely start a REPL; else None."""
-    tokens = shlex.split(command, posix=(os.name != "nt"))
+    tokens = None
+    if command.isascii() and not _ODD_SPACE.search(command):
+        tokens = command.split(None, 2)[:2]     # all we ever inspect
+        if any(_SHELL_META.search(tok) for tok in tokens):
+            tokens = None
+    if tokens is None:
+        tokens = shlex.split(command, posix=(os.name != "nt"))
     if not tokens:
         return None
 
     cmd = tokens[0].lower()
-    if cmd in INTERACTIVE_SHELLS:
+    if cmd in _SHELL_KEYS:
         if len(tokens) == 1:
             return f"'{cmd}' would start an interactive {INTERACTIVE_SHELLS[cmd]}."
-        if tokens[1].lower() in INTERACTIVE_FLAGS:
+        if tokens[1].lower() in _FLAG_KEYS:
             return f"'{cmd} {tokens[1]}' requests interactive mode."
     return None
 
 
 def contains_prompt(text: str) -> bool:
     """True if the *last line* of *text* looks like a shell/REPL prompt."""
-    if not text:
+    # Only the tail matters; widen to the whole text if the window holds
+    # nothing but whitespace or cuts into the last line.
+    tail = text[-PROMPT_WINDOW:].rstrip()
+    lines = tail.splitlines()
+    if len(text) > PROMPT_WINDOW and len(lines) < 2:
+        lines = text.rstrip().splitlines()
+    if not lines:
         return False
-    last = text.rstrip().splitlines()[-1]
-    return any(rx.fullmatch(last) for rx in PROMPT_REGEXES)
+    last = lines[-1]
+    return _PROMPT_RX.fullmatch(last) is not None
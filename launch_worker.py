@@ -3,23 +3,126 @@ Wrapper that respawns *autoMcp.py* whenever it exits with code 87.
 Run **this** from the Claude desktop app.
 """
 
-import subprocess, sys, threading
+import asyncio, errno, os, queue, sys, threading
 
 PY            = sys.executable
 WORKER_MODULE = "autoMcp"    # adjust if filename differs
 CMD           = [PY, "-m", WORKER_MODULE]
 RESTART_CODE  = 87                 # reserved by request_restart()
+CHUNK         = 64 << 10           # bytes per forwarded read
+SPLICE_CHUNK  = 1 << 20            # bytes per os.splice() call
+FLUSH_TIMEOUT = 1.0                # seconds to flush queued output on exit
 
-def _pipe(src, dst):
-    for chunk in iter(src.readline, b""):
-        dst.buffer.write(chunk)
-        dst.flush()
+class _Sink:
+    """Order-preserving writer for one of our own output streams.
 
-while True:
-    proc = subprocess.Popen(CMD, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    threading.Thread(target=_pipe, args=(proc.stdout, sys.stdout), daemon=True).start()
-    threading.Thread(target=_pipe, args=(proc.stderr, sys.stderr), daemon=True).start()
+    Writes happen on a daemon thread, so a consumer that stops reading only
+    backs up this sink's queue: the worker is never blocked on the pipe, and
+    the event loop and the other stream keep going.
+    """
 
-    if proc.wait() != RESTART_CODE:
-        sys.exit(proc.returncode)
-    # otherwise loop to respawn
+    def __init__(self, stream):
+        self.fd = stream.fileno()
+        self._queue = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    @property
+    def idle(self):
+        """True when everything queued so far has been written."""
+        return self._queue.unfinished_tasks == 0
+
+    def write(self, data):
+        self._queue.put(data)
+
+    async def flush(self, timeout):
+        """Wait up to *timeout* seconds for everything queued to be written."""
+        done = threading.Event()
+        self._queue.put(done)
+        await asyncio.to_thread(done.wait, timeout)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if isinstance(item, threading.Event):
+                    item.set()
+                    continue
+                view = memoryview(item)
+                while view:
+                    view = view[os.write(self.fd, view):]
+            except OSError:
+                pass    # consumer went away; drop the data
+            finally:
+                self._queue.task_done()
+
+async def _pipe(src, sink):
+    while chunk := await src.read(CHUNK):
+        sink.write(chunk)
+
+async def _splice(src: int, sink: _Sink) -> None:
+    """Move bytes from pipe *src* to *sink* in-kernel (Linux) until EOF.
+
+    The splice never blocks and is only tried while *sink* has nothing queued.
+    If the destination is full (EAGAIN) or cannot be spliced into (EINVAL,
+    e.g. a tty), the data is read and queued on *sink* instead, so neither the
+    loop nor the worker waits on a slow consumer.
+    """
+    loop = asyncio.get_running_loop()
+    readable = asyncio.Event()
+    os.set_blocking(src, False)
+    loop.add_reader(src, readable.set)
+    spliceable = True
+    try:
+        while True:
+            await readable.wait()
+            readable.clear()
+            if spliceable and sink.idle:
+                try:
+                    n = os.splice(src, sink.fd, SPLICE_CHUNK,
+                                  flags=os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK)
+                except BlockingIOError:
+                    pass                   # destination full: queue instead
+                except OSError as e:
+                    if e.errno != errno.EINVAL:
+                        raise
+                    spliceable = False     # e.g. a tty on the other end
+                else:
+                    if n == 0:
+                        break
+                    continue
+            try:
+                chunk = os.read(src, CHUNK)
+            except BlockingIOError:
+                continue
+            if not chunk:
+                break
+            sink.write(chunk)
+    finally:
+        loop.remove_reader(src)
+        os.close(src)
+
+async def _run_worker(out, err) -> int:
+    if hasattr(os, "splice"):
+        out_r, out_w = os.pipe()
+        err_r, err_w = os.pipe()
+        proc = await asyncio.create_subprocess_exec(*CMD, stdout=out_w, stderr=err_w)
+        os.close(out_w)
+        os.close(err_w)
+        pumps = (_splice(out_r, out), _splice(err_r, err))
+    else:
+        proc = await asyncio.create_subprocess_exec(
+            *CMD, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        pumps = (_pipe(proc.stdout, out), _pipe(proc.stderr, err))
+    await asyncio.gather(*pumps, proc.wait())
+    return proc.returncode
+
+async def main() -> int:
+    out, err = _Sink(sys.stdout), _Sink(sys.stderr)
+    while (rc := await _run_worker(out, err)) == RESTART_CODE:
+        pass    # loop to respawn
+    # A consumer that stopped reading must not keep us alive.
+    await asyncio.gather(out.flush(FLUSH_TIMEOUT), err.flush(FLUSH_TIMEOUT))
+    return rc
+
+sys.exit(asyncio.run(main()))